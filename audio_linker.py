@@ -1,9 +1,73 @@
 """Audio device volume linking logic."""
-import time
+import logging
 import threading
-from typing import Optional, List, Tuple
+import time
+from array import array
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, List, Tuple
 from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
-from comtypes import cast, POINTER
+from pycaw.callbacks import MMNotificationClient
+from pycaw.constants import DEVICE_STATE, STGM, EDataFlow, ERole
+from pycaw.api.mmdeviceapi.depend.structures import PROPERTYKEY
+from pycaw.api.endpointvolume import IAudioEndpointVolumeCallback as _IAudioEndpointVolumeCallback
+from ctypes import byref
+from comtypes import cast, POINTER, CLSCTX_ALL, COMError, COMObject, GUID, CoInitialize, CoUninitialize
+
+logger = logging.getLogger(__name__)
+
+# Minimum seconds between logged initialization errors for the same device
+_INIT_ERROR_LOG_INTERVAL = 10.0
+
+# Event context passed with every volume change we make, so the resulting
+# notifications can be told apart from changes made by the user or other apps
+SYNC_GUID = GUID.create_new()
+
+# Volume levels are compared in steps of 1/_VOLUME_RESOLUTION. This is deliberately
+# finer than the device's own GetVolumeStepInfo steps, which only describe
+# VolumeStepUp/Down granularity; the scalar level can be set to any value in between
+_VOLUME_RESOLUTION = 1000
+
+# Marks a device whose volume hasn't been seen yet in AudioLinker._last_steps
+_NO_STEP = -1
+
+PKEY_Device_FriendlyName = PROPERTYKEY(GUID("{a45c254e-df1c-4efd-8020-67d146a850e0}"), 14)
+
+
+class IAudioEndpointVolumeCallback(_IAudioEndpointVolumeCallback):
+    """IAudioEndpointVolumeCallback with the IID from endpointvolume.h.
+    
+    pycaw declares the interface under a different IID. Deriving from it keeps
+    the method layout and makes callback objects answer QueryInterface for both.
+    """
+    _iid_ = GUID("{657804FA-D6AD-4496-8A60-352752AF4F89}")
+    _methods_ = []
+
+
+class VolumeCallback(COMObject):
+    """Receives volume change notifications for an AudioDevice."""
+    
+    _com_interfaces_ = [IAudioEndpointVolumeCallback]
+    
+    def __init__(self, device: "AudioDevice"):
+        """Initialize callback for the given device."""
+        super().__init__()
+        self.device = device
+    
+    def OnNotify(self, pNotify):
+        """Called by Windows on an audio service thread when the volume changes."""
+        data = pNotify.contents
+        if data.guidEventContext == SYNC_GUID:
+            # Caused by our own set_volume call
+            return
+        self.device._on_volume_notify(data.fMasterVolume)
+
+
+@dataclass
+class DeviceInfo:
+    """An enumerated output device: its id, friendly name and IMMDevice."""
+    id: str
+    name: str
+    mm_device: Any
 
 
 class AudioDevice:
@@ -14,41 +78,61 @@ class AudioDevice:
         self.device_id = device_id
         self.device_name = device_name
         self._volume_interface: Optional[IAudioEndpointVolume] = None
-        self._device = None
+        self._mm_device = None
+        # Keep a reference to the registered callback so it isn't garbage collected
+        self._callback: Optional[VolumeCallback] = None
+        self._listener: Optional[Callable[["AudioDevice", float], None]] = None
+        self._last_err_ts: Optional[float] = None
+    
+    @classmethod
+    def from_device_info(cls, info: DeviceInfo) -> "AudioDevice":
+        """Create an audio device from an enumerated device, keeping it for later initialization."""
+        audio_device = cls(info.id, info.name)
+        audio_device._mm_device = info.mm_device
+        return audio_device
     
     def initialize(self) -> bool:
         """Initialize the device and get volume interface."""
         try:
-            devices = AudioUtilities.GetAllDevices()
-            for pycaw_device in devices:
-                if pycaw_device.id == self.device_id:
-                    self._device = pycaw_device
-                    try:
-                        # Get the volume interface using EndpointVolume property
-                        if hasattr(pycaw_device, 'EndpointVolume'):
-                            volume_interface = pycaw_device.EndpointVolume
-                            if volume_interface:
-                                # Cast to IAudioEndpointVolume pointer
-                                self._volume_interface = cast(volume_interface, POINTER(IAudioEndpointVolume))
-                                if self._volume_interface:
-                                    return True
-                        else:
-                            print(f"Device {self.device_name} does not have EndpointVolume property")
-                            return False
-                    except AttributeError as e:
-                        print(f"Device {self.device_name} does not support volume control: {e}")
-                        return False
-                    except Exception as e:
-                        print(f"Error getting volume interface for {self.device_name}: {e}")
-                        import traceback
-                        traceback.print_exc()
-                        return False
+            if self._mm_device is not None:
+                try:
+                    return self._activate(self._mm_device)
+                except COMError:
+                    # The stored device is stale (e.g. it was unplugged), look it up again
+                    invalidate_device_cache()
+            
+            # The default output device can be fetched directly without enumerating
+            speakers = _get_default_output_device()
+            if speakers is not None and speakers.GetId() == self.device_id:
+                self._mm_device = speakers
+                return self._activate(speakers)
+            
+            _, by_id, _ = _get_all_devices_cached()
+            info = by_id.get(self.device_id)
+            if info is None:
+                return False
+            self._mm_device = info.mm_device
+            return self._activate(info.mm_device)
+        except Exception:
+            # A disconnected device is retried every 0.5s, so don't log every failure
+            now = time.monotonic()
+            if self._last_err_ts is None or now - self._last_err_ts >= _INIT_ERROR_LOG_INTERVAL:
+                self._last_err_ts = now
+                logger.exception("Error initializing device %s", self.device_name)
             return False
-        except Exception as e:
-            print(f"Error initializing device {self.device_name}: {e}")
-            import traceback
-            traceback.print_exc()
+    
+    def _activate(self, mm_device) -> bool:
+        """Activate the volume interface of an IMMDevice and register for volume notifications."""
+        volume_interface = mm_device.Activate(IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+        if not volume_interface:
             return False
+        # Cast to IAudioEndpointVolume pointer
+        volume_interface = cast(volume_interface, POINTER(IAudioEndpointVolume))
+        callback = VolumeCallback(self)
+        volume_interface.RegisterControlChangeNotify(callback)
+        self._volume_interface = volume_interface
+        self._callback = callback
+        return True
     
     def get_volume(self) -> Optional[float]:
         """Get current volume level (0.0 to 1.0)."""
@@ -58,7 +142,7 @@ class AudioDevice:
             # Call methods directly on the pointer
             return self._volume_interface.GetMasterVolumeLevelScalar()
         except Exception as e:
-            print(f"Error getting volume for {self.device_name}: {e}")
+            logger.error("Error getting volume for %s: %s", self.device_name, e)
             return None
     
     def set_volume(self, volume: float) -> bool:
@@ -69,15 +153,39 @@ class AudioDevice:
             # Clamp volume to valid range
             volume = max(0.0, min(1.0, volume))
             # Call methods directly on the pointer
-            self._volume_interface.SetMasterVolumeLevelScalar(volume, None)
+            self._volume_interface.SetMasterVolumeLevelScalar(volume, byref(SYNC_GUID))
             return True
         except Exception as e:
-            print(f"Error setting volume for {self.device_name}: {e}")
+            logger.error("Error setting volume for %s: %s", self.device_name, e)
             return False
     
     def is_available(self) -> bool:
         """Check if device is available."""
         return self._volume_interface is not None
+    
+    def set_listener(self, listener: Optional[Callable[["AudioDevice", float], None]]) -> None:
+        """Set the function called with (device, volume) when the volume changes."""
+        self._listener = listener
+    
+    def close(self) -> None:
+        """Stop receiving volume change notifications and release the volume interface."""
+        self._listener = None
+        if self._callback and self._volume_interface:
+            try:
+                self._volume_interface.UnregisterControlChangeNotify(self._callback)
+            except Exception as e:
+                logger.error("Error unregistering volume callback for %s: %s", self.device_name, e)
+        self._callback = None
+        self._volume_interface = None
+    
+    def _on_volume_notify(self, volume: float) -> None:
+        """Forward a volume change notification to the listener."""
+        listener = self._listener
+        if listener:
+            try:
+                listener(self, volume)
+            except Exception as e:
+                logger.error("Error handling volume change for %s: %s", self.device_name, e)
 
 
 class AudioLinker:
@@ -85,169 +193,334 @@ class AudioLinker:
     
     def __init__(self, device1: Optional[AudioDevice], device2: Optional[AudioDevice]):
         """Initialize audio linker with two devices."""
-        self.device1 = device1
-        self.device2 = device2
+        # Hot state for the notification path is kept flat and indexed by slot (0 or 1):
+        # the linked devices and the last known volume of each, in _VOLUME_RESOLUTION steps
+        self._devices: Tuple[Optional[AudioDevice], Optional[AudioDevice]] = (device1, device2)
+        self._last_steps = array('i', (_NO_STEP, _NO_STEP))
         self._running = False
         self._thread: Optional[threading.Thread] = None
-        self._lock = threading.Lock()
+        # Guards the state below and wakes the monitor thread when it changes
+        self._cond = threading.Condition()
         self._enabled = True
-        self._syncing = False  # Flag to prevent feedback loops
+        self._changed = False
+        # Held while volume changes are being propagated, only ever acquired without blocking
+        self._sync_lock = threading.Lock()
+        # Latest volume per slot still waiting to be propagated, guarded by _pending_lock
+        self._pending_volumes: List[Optional[float]] = [None, None]
+        self._pending_lock = threading.Lock()
+    
+    @property
+    def device1(self) -> Optional[AudioDevice]:
+        """First linked device."""
+        return self._devices[0]
+    
+    @property
+    def device2(self) -> Optional[AudioDevice]:
+        """Second linked device."""
+        return self._devices[1]
     
     def set_devices(self, device1: Optional[AudioDevice], device2: Optional[AudioDevice]) -> None:
         """Update the devices being linked."""
-        with self._lock:
-            self.device1 = device1
-            self.device2 = device2
+        with self._cond:
+            old_devices = self._devices
+            self._devices = (device1, device2)
+            self._last_steps = array('i', (_NO_STEP, _NO_STEP))
+            with self._pending_lock:
+                # Queued volumes belong to the old devices
+                self._pending_volumes = [None, None]
+            self._changed = True
+            self._cond.notify_all()
+        for device in old_devices:
+            if device and device is not device1 and device is not device2:
+                device.close()
     
     def set_enabled(self, enabled: bool) -> None:
         """Enable or disable linking."""
-        with self._lock:
+        with self._cond:
             self._enabled = enabled
+            self._last_steps = array('i', (_NO_STEP, _NO_STEP))
+            self._changed = True
+            self._cond.notify_all()
     
     def is_enabled(self) -> bool:
         """Check if linking is enabled."""
         return self._enabled
     
     def start(self) -> None:
-        """Start the volume linking thread."""
-        if self._running:
-            return
+        """Start listening for volume changes on both devices."""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+            self._changed = True
         
-        self._running = True
         self._thread = threading.Thread(target=self._monitor_loop, daemon=True)
         self._thread.start()
     
     def stop(self) -> None:
-        """Stop the volume linking thread."""
-        self._running = False
+        """Stop listening for volume changes."""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
         if self._thread:
             self._thread.join(timeout=1.0)
     
-    def _monitor_loop(self) -> None:
-        """Main monitoring loop that synchronizes volumes bidirectionally."""
-        last_volume1 = None
-        last_volume2 = None
+    def _on_volume_changed(self, source: AudioDevice, volume: float) -> None:
+        """Propagate a volume change notification to the other device.
+        
+        Called on a Windows audio thread, possibly for both devices at once.
+        The change is queued as the latest volume of its device and applied by
+        whichever thread holds the sync lock, so a change arriving while another
+        is being synced is applied after it instead of being dropped.
+        """
+        devices = self._devices
+        if source is devices[0]:
+            i = 0
+        elif source is devices[1]:
+            i = 1
+        else:
+            return
+        with self._pending_lock:
+            self._pending_volumes[i] = volume
         
-        while self._running:
+        while self._sync_lock.acquire(blocking=False):
             try:
-                with self._lock:
-                    if not self._enabled:
-                        time.sleep(0.1)
-                        continue
-                    
-                    if not self.device1 or not self.device2:
-                        time.sleep(0.1)
-                        continue
-                    
-                    # Reinitialize devices if needed
-                    if not self.device1.is_available():
-                        if not self.device1.initialize():
-                            time.sleep(0.5)
+                while True:
+                    with self._pending_lock:
+                        pending = self._pending_volumes
+                        self._pending_volumes = [None, None]
+                    if pending[0] is None and pending[1] is None:
+                        break
+                    for i in (0, 1):
+                        if pending[i] is not None:
+                            self._sync_volume(i, pending[i])
+            finally:
+                self._sync_lock.release()
+            # A change queued just before the release is ours to apply
+            with self._pending_lock:
+                if self._pending_volumes[0] is None and self._pending_volumes[1] is None:
+                    return
+    
+    def _sync_volume(self, i: int, volume: float) -> None:
+        """Set the volume of the device in slot 1 - i to the new volume of the one in slot i."""
+        if not self._enabled:
+            return
+        
+        devices = self._devices
+        last_steps = self._last_steps
+        peer = devices[1 - i]
+        if not devices[i] or not peer or not peer.is_available():
+            return
+        
+        # Ignore notifications that don't change the volume (e.g. mute toggles)
+        step = round(volume * _VOLUME_RESOLUTION)
+        if step == last_steps[i]:
+            return
+        
+        last_steps[i] = step
+        last_steps[1 - i] = step
+        peer.set_volume(volume)
+    
+    def _monitor_loop(self) -> None:
+        """Keep both devices initialized and subscribed to volume changes.
+        
+        Volume changes are pushed by Windows through VolumeCallback, so this
+        thread only wakes up when the devices or enabled state change, or to
+        retry devices that could not be initialized yet.
+        """
+        CoInitialize()
+        devices: Tuple[Optional[AudioDevice], ...] = ()
+        pending = False
+        try:
+            while True:
+                with self._cond:
+                    # Sleep until something changes, retrying unavailable devices every 0.5s
+                    self._cond.wait_for(lambda: self._changed or not self._running,
+                                        timeout=0.5 if pending else None)
+                    if not self._running:
+                        break
+                    self._changed = False
+                    devices = self._devices
+                    enabled = self._enabled
+                
+                try:
+                    pending = False
+                    for device in devices:
+                        if not device:
                             continue
-                    
-                    if not self.device2.is_available():
-                        if not self.device2.initialize():
-                            time.sleep(0.5)
+                        # Reinitialize devices if needed
+                        if not device.is_available() and not device.initialize():
+                            pending = True
                             continue
+                        device.set_listener(self._on_volume_changed)
                     
-                    # Skip if we're currently syncing to avoid feedback loops
-                    if self._syncing:
-                        time.sleep(0.1)
-                        continue
-                    
-                    # Get current volumes from both devices
-                    current_volume1 = self.device1.get_volume()
-                    current_volume2 = self.device2.get_volume()
-                    
-                    if current_volume1 is None or current_volume2 is None:
-                        time.sleep(0.1)
-                        continue
-                    
-                    # Check if device 1 volume changed
-                    if last_volume1 is None or abs(current_volume1 - last_volume1) > 0.001:
-                        # Device 1 changed, sync to device 2
-                        self._syncing = True
-                        self.device2.set_volume(current_volume1)
-                        last_volume1 = current_volume1
-                        last_volume2 = current_volume1  # Update both to prevent feedback
-                        self._syncing = False
-                    # Check if device 2 volume changed
-                    elif last_volume2 is None or abs(current_volume2 - last_volume2) > 0.001:
-                        # Device 2 changed, sync to device 1
-                        self._syncing = True
-                        self.device1.set_volume(current_volume2)
-                        last_volume2 = current_volume2
-                        last_volume1 = current_volume2  # Update both to prevent feedback
-                        self._syncing = False
-                    else:
-                        # No change detected, update last known volumes
-                        last_volume1 = current_volume1
-                        last_volume2 = current_volume2
-                
-                time.sleep(0.1)  # Poll every 100ms
-                
-            except Exception as e:
-                print(f"Error in monitor loop: {e}")
-                self._syncing = False
-                time.sleep(0.5)
+                    # Bring device 2 in line with device 1 when (re)linking
+                    if enabled and not pending and devices[0] and devices[1]:
+                        volume = devices[0].get_volume()
+                        if volume is not None:
+                            self._on_volume_changed(devices[0], volume)
+                except Exception as e:
+                    logger.error("Error in monitor loop: %s", e)
+                    pending = True
+        finally:
+            for device in devices:
+                if device:
+                    device.close()
+            CoUninitialize()
 
 
-def get_all_audio_devices() -> List[Tuple[str, str]]:
-    """Get list of available output audio devices as (id, name) tuples, deduplicated."""
-    devices = []
-    seen_names = set()
+class DeviceNotificationClient(MMNotificationClient):
+    """Invalidates the device cache when audio endpoints are added, removed or change state."""
+    
+    def on_device_added(self, added_device_id):
+        _on_devices_changed()
+    
+    def on_device_removed(self, removed_device_id):
+        _on_devices_changed()
+    
+    def on_device_state_changed(self, device_id, new_state, new_state_id):
+        _on_devices_changed()
+
+
+# Enumerating endpoints is expensive, so results are shared between lookups
+# for a short time and dropped as soon as Windows reports a device change.
+_DEVICE_CACHE_TTL = 2.0
+_device_cache: Optional[Tuple[List[DeviceInfo], Dict[str, DeviceInfo], Dict[str, DeviceInfo]]] = None
+_device_cache_ts = 0.0
+_device_enumerator = None
+_notification_client: Optional[DeviceNotificationClient] = None
+_device_change_listeners: List[Callable[[], None]] = []
+
+
+def invalidate_device_cache() -> None:
+    """Drop the cached device list so the next lookup enumerates again."""
+    global _device_cache
+    _device_cache = None
+
+
+def add_device_change_listener(listener: Callable[[], None]) -> None:
+    """Call listener (on a Windows audio thread) whenever output devices change."""
+    _device_change_listeners.append(listener)
+    _register_device_notifications()
+
+
+def _on_devices_changed() -> None:
+    """Drop the device cache and notify listeners of a device change."""
+    invalidate_device_cache()
+    for listener in list(_device_change_listeners):
+        try:
+            listener()
+        except Exception as e:
+            logger.error("Error handling device change: %s", e)
+
+
+def _register_device_notifications() -> None:
+    """Register for endpoint change notifications once per process."""
+    global _device_enumerator, _notification_client
+    if _notification_client is not None:
+        return
     try:
-        all_devices = AudioUtilities.GetAllDevices()
-        for device in all_devices:
-            # Filter to only output devices (render devices)
-            # Check if device has DataFlow property (eRender = output, eCapture = input)
-            # Also verify it has EndpointVolume for volume control
-            try:
-                # Check DataFlow if available (eRender = 0 = output device)
-                if hasattr(device, 'DataFlow'):
-                    # eRender (0) = output, eCapture (1) = input
-                    if device.DataFlow != 0:  # Not eRender, skip input devices
-                        continue
-                
-                # Verify device supports volume control
-                if hasattr(device, 'EndpointVolume'):
-                    device_name = device.FriendlyName
-                    # Deduplicate by name - keep first occurrence of each unique name
-                    if device_name not in seen_names:
-                        seen_names.add(device_name)
-                        devices.append((device.id, device_name))
-            except (AttributeError, Exception):
-                # Skip devices that don't support volume control or can't be accessed
-                continue
+        enumerator = AudioUtilities.GetDeviceEnumerator()
+        client = DeviceNotificationClient()
+        enumerator.RegisterEndpointNotificationCallback(client)
+        # Keep references so the callback stays registered and isn't garbage collected
+        _device_enumerator = enumerator
+        _notification_client = client
     except Exception as e:
-        print(f"Error enumerating devices: {e}")
+        logger.error("Error registering device notifications: %s", e)
+
+
+def _get_default_output_device():
+    """Get the IMMDevice of the default output device, or None if there is none."""
+    try:
+        # Ask the enumerator directly: newer pycaw wraps GetSpeakers() in an AudioDevice
+        # that reads every property and has no GetId()/Activate()
+        enumerator = AudioUtilities.GetDeviceEnumerator()
+        return enumerator.GetDefaultAudioEndpoint(EDataFlow.eRender.value, ERole.eMultimedia.value)
+    except COMError:
+        return None
+
+
+def _enumerate_output_devices() -> List[DeviceInfo]:
+    """Enumerate active output devices, reading only the id and friendly name of each."""
+    devices = []
+    # Only enumerate active output (render) endpoints instead of filtering every endpoint
+    enumerator = AudioUtilities.GetDeviceEnumerator()
+    collection = enumerator.EnumAudioEndpoints(EDataFlow.eRender.value, DEVICE_STATE.ACTIVE.value)
+    for i in range(collection.GetCount()):
+        try:
+            mm_device = collection.Item(i)
+            store = mm_device.OpenPropertyStore(STGM.STGM_READ.value)
+            value = store.GetValue(PKEY_Device_FriendlyName)
+            device_name = value.GetValue()
+            value.clear()
+            devices.append(DeviceInfo(mm_device.GetId(), device_name, mm_device))
+        except COMError:
+            # Skip devices that can't be accessed
+            continue
     return devices
 
 
+def _get_all_devices_cached() -> Tuple[List[DeviceInfo], Dict[str, DeviceInfo], Dict[str, DeviceInfo]]:
+    """Get output devices as (devices, by_id, by_name), reusing a recent enumeration if available."""
+    global _device_cache, _device_cache_ts
+    _register_device_notifications()
+    cache = _device_cache
+    if cache is not None and time.monotonic() - _device_cache_ts < _DEVICE_CACHE_TTL:
+        return cache
+    devices = _enumerate_output_devices()
+    by_id = {}
+    by_name = {}
+    for info in devices:
+        by_id[info.id] = info
+        # Keep the first device for each name
+        by_name.setdefault(info.name, info)
+    cache = (devices, by_id, by_name)
+    _device_cache = cache
+    _device_cache_ts = time.monotonic()
+    return cache
+
+
+def get_output_devices() -> List[DeviceInfo]:
+    """Get available output devices, deduplicated, keeping each IMMDevice for activation."""
+    try:
+        # by_name holds the first device for each unique name
+        _, _, by_name = _get_all_devices_cached()
+        return list(by_name.values())
+    except Exception as e:
+        logger.error("Error enumerating devices: %s", e)
+        return []
+
+
+def get_all_audio_devices() -> List[Tuple[str, str]]:
+    """Get list of available output audio devices as (id, name) tuples, deduplicated."""
+    return [(info.id, info.name) for info in get_output_devices()]
+
+
 def find_device_by_id(device_id: str) -> Optional[AudioDevice]:
     """Find and initialize an audio device by ID."""
     try:
-        devices = AudioUtilities.GetAllDevices()
-        for device in devices:
-            if device.id == device_id:
-                audio_device = AudioDevice(device.id, device.FriendlyName)
-                if audio_device.initialize():
-                    return audio_device
+        _, by_id, _ = _get_all_devices_cached()
+        info = by_id.get(device_id)
+        if info is not None:
+            audio_device = AudioDevice.from_device_info(info)
+            if audio_device.initialize():
+                return audio_device
     except Exception as e:
-        print(f"Error finding device {device_id}: {e}")
+        logger.error("Error finding device %s: %s", device_id, e)
     return None
 
 
 def find_device_by_name(device_name: str) -> Optional[AudioDevice]:
     """Find and initialize an audio device by name."""
     try:
-        devices = AudioUtilities.GetAllDevices()
-        for device in devices:
-            if device.FriendlyName == device_name:
-                audio_device = AudioDevice(device.id, device.FriendlyName)
-                if audio_device.initialize():
-                    return audio_device
+        _, _, by_name = _get_all_devices_cached()
+        info = by_name.get(device_name)
+        if info is not None:
+            audio_device = AudioDevice.from_device_info(info)
+            if audio_device.initialize():
+                return audio_device
     except Exception as e:
-        print(f"Error finding device {device_name}: {e}")
+        logger.error("Error finding device %s: %s", device_name, e)
     return None
 
@@ -1,10 +1,12 @@
 """Build script for creating AudioLink executable."""
-import PyInstaller.__main__
 import os
 import sys
 
 def build():
     """Build the AudioLink executable using PyInstaller."""
+    # Imported here so importing this module doesn't load PyInstaller
+    import PyInstaller.__main__
+    
     # PyInstaller arguments
     args = [
         'main.py',
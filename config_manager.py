@@ -1,11 +1,34 @@
 """Configuration management for audio device linker."""
+import atexit
 import json
 import os
 import sys
+import threading
+from functools import lru_cache
 from pathlib import Path
 from typing import Optional, Dict, Any, Tuple
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+
+def _dumps(data: Dict[str, Any]) -> bytes:
+    """Serialize config data to compact JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(',', ':')).encode('utf-8')
+
+
+def _loads(data: bytes) -> Dict[str, Any]:
+    """Parse config data from JSON bytes."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+@lru_cache(maxsize=1)
 def get_config_path() -> Path:
     """Get the absolute path to the config file.
     
@@ -39,7 +62,13 @@ class ConfigManager:
         else:
             self.config_file = Path(config_file)
         self.config: Dict[str, Any] = {}
+        # Setters mark the config dirty and a timer writes it once changes settle
+        self._dirty = False
+        self._flush_timer: Optional[threading.Timer] = None
+        self._lock = threading.Lock()
+        self._dir_ready = False
         self.load()
+        atexit.register(self._flush)
     
     def _migrate_old_config(self) -> bool:
         """Try to migrate config from old locations. Returns True if migration succeeded."""
@@ -58,8 +87,7 @@ class ConfigManager:
         for old_path in old_locations:
             if old_path.exists() and old_path != self.config_file:
                 try:
-                    with open(old_path, 'r') as f:
-                        old_config = json.load(f)
+                    old_config = _loads(old_path.read_bytes())
                     # Migrate the config
                     self.config = old_config
                     self.save()
@@ -67,7 +95,7 @@ class ConfigManager:
                     # Optionally remove old config (commented out for safety)
                     # old_path.unlink()
                     return True
-                except (json.JSONDecodeError, IOError) as e:
+                except (ValueError, OSError) as e:
                     print(f"Error migrating config from {old_path}: {e}")
         
         return False
@@ -76,9 +104,8 @@ class ConfigManager:
         """Load configuration from file."""
         if self.config_file.exists():
             try:
-                with open(self.config_file, 'r') as f:
-                    self.config = json.load(f)
-            except (json.JSONDecodeError, IOError) as e:
+                self.config = _loads(self.config_file.read_bytes())
+            except (ValueError, OSError) as e:
                 print(f"Error loading config: {e}")
                 self.config = {}
         else:
@@ -95,15 +122,49 @@ class ConfigManager:
                 }
                 self.save()
     
-    def save(self) -> None:
-        """Save configuration to file."""
+    def save(self) -> bool:
+        """Save configuration to file. Returns True if it was written."""
         try:
             # Ensure the directory exists
-            self.config_file.parent.mkdir(parents=True, exist_ok=True)
-            with open(self.config_file, 'w') as f:
-                json.dump(self.config, f, indent=2)
+            if not self._dir_ready:
+                self.config_file.parent.mkdir(parents=True, exist_ok=True)
+                self._dir_ready = True
+            # Write to a temp file and swap it in so a crash can't leave a truncated config
+            tmp_file = self.config_file.with_suffix('.json.tmp')
+            tmp_file.write_bytes(_dumps(self.config))
+            os.replace(tmp_file, self.config_file)
+            return True
         except IOError as e:
             print(f"Error saving config: {e}")
+            return False
+    
+    def close(self) -> None:
+        """Write any pending changes to disk."""
+        self._flush()
+    
+    def _update(self, **values: Any) -> None:
+        """Apply config changes and schedule a save, coalescing changes made in quick succession."""
+        # The flush timer serializes the config on its own thread, so only change it under the lock
+        with self._lock:
+            self.config.update(values)
+            self._dirty = True
+            if self._flush_timer:
+                self._flush_timer.cancel()
+            self._flush_timer = threading.Timer(0.5, self._flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+    
+    def _flush(self) -> None:
+        """Save the config if it has unsaved changes."""
+        with self._lock:
+            if self._flush_timer:
+                self._flush_timer.cancel()
+                self._flush_timer = None
+            if not self._dirty:
+                return
+            # Stay dirty if the write fails so the exit flush tries again
+            if self.save():
+                self._dirty = False
     
     def get_device1(self) -> Tuple[Optional[str], Optional[str]]:
         """Get device 1 ID and name."""
@@ -111,9 +172,7 @@ class ConfigManager:
     
     def set_device1(self, device_id: str, device_name: str) -> None:
         """Set device 1 ID and name."""
-        self.config["device1_id"] = device_id
-        self.config["device1_name"] = device_name
-        self.save()
+        self._update(device1_id=device_id, device1_name=device_name)
     
     def get_device2(self) -> Tuple[Optional[str], Optional[str]]:
         """Get device 2 ID and name."""
@@ -121,9 +180,7 @@ class ConfigManager:
     
     def set_device2(self, device_id: str, device_name: str) -> None:
         """Set device 2 ID and name."""
-        self.config["device2_id"] = device_id
-        self.config["device2_name"] = device_name
-        self.save()
+        self._update(device2_id=device_id, device2_name=device_name)
     
     def is_linking_enabled(self) -> bool:
         """Check if linking is enabled."""
@@ -131,8 +188,7 @@ class ConfigManager:
     
     def set_linking_enabled(self, enabled: bool) -> None:
         """Set linking enabled state."""
-        self.config["linking_enabled"] = enabled
-        self.save()
+        self._update(linking_enabled=enabled)
     
     def is_auto_start(self) -> bool:
         """Check if auto-start is enabled."""
@@ -140,6 +196,5 @@ class ConfigManager:
     
     def set_auto_start(self, enabled: bool) -> None:
         """Set auto-start enabled state."""
-        self.config["auto_start"] = enabled
-        self.save()
+        self._update(auto_start=enabled)
 
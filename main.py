@@ -1,15 +1,34 @@
 """Main application entry point for Audio Device Volume Linker."""
+import base64
+import io
 import sys
 import threading
-from typing import Optional
-from PIL import Image, ImageDraw
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Tuple
+from PIL import Image
 import pystray
 from pystray import MenuItem as item, Menu
+from comtypes import CoInitialize, CoUninitialize
 
-from config_manager import ConfigManager
-from audio_linker import AudioLinker, AudioDevice, find_device_by_id, get_all_audio_devices
+from config_manager import ConfigManager, get_config_path
+from audio_linker import (AudioLinker, AudioDevice, DeviceInfo, add_device_change_listener,
+                          find_device_by_id, get_output_devices)
 from auto_start import is_auto_start_enabled, toggle_auto_start
 
+# 64x64 tray icon: two linked device circles with volume waves, pre-rendered as a
+# base64-encoded PNG so startup doesn't have to draw it
+ICON_PNG = (
+    b"iVBORw0KGgoAAAANSUhEUgAAAEAAAABACAYAAACqaXHeAAABH0lEQVR42u2YvRHDIAxGDZcRXDNE"
+    b"qkyQSVx5jAzhKmNkCFcMQe0dnAES/wCS7EveK23g+04ScKJpAAAAAAAAADbphnHuhnGWHnuUnv/3"
+    b"hHpqWqksJcr/KL1qUxpmtPRcramlf8/+5jSCLq1XdQbEGLO+16KhVxS1azfsLrf47KsrQVPP1Zpp"
+    b"Q/gYM6UkFgRtPVdq5puRNWMlQbDQc7lm9hhZMpYTBCs9L70HJdax1Mu6BUqycfZ53iobe9ez1vPa"
+    b"2Sidb6V3se4j2hCa++M17z3N6QYJgC7mW2BKafV+lj4ExSqgdl/mzrfS2wyARDOTs561nrfIypnn"
+    b"eYkoSreqlnp0g7wHnOyFxlrPaRmTPs2P0AMAAAAAAAAAAAAA+DHe0O72Fw37LGcAAAAASUVORK5C"
+    b"YII="
+)
+
 
 class AudioLinkApp:
     """Main application class for audio device volume linker."""
@@ -21,33 +40,81 @@ class AudioLinkApp:
         self.device1: Optional[AudioDevice] = None
         self.device2: Optional[AudioDevice] = None
         self.icon: Optional[pystray.Icon] = None
-        self._setup_devices()
+        # Mirrors the linker's enabled state for the menu, only changed by _toggle_linking
+        self._linking_enabled = False
+        # (id, name, submenu label) of each output device, dropped on device change notifications.
+        # Guarded by _devices_lock; _devices_generation counts the notifications so a list
+        # enumerated before one isn't cached after it
+        self._devices_cache: Optional[List[Tuple[str, str, str]]] = None
+        self._devices_generation = 0
+        self._devices_lock = threading.Lock()
+        # Enumerated devices of the cached list by id, turned into an AudioDevice when selected
+        self._device_infos: Dict[str, DeviceInfo] = {}
+        # (timestamp, value) of the last registry read for the auto-start checkmark
+        self._auto_start_cache: Tuple[float, bool] = (float('-inf'), False)
+        # Coalesces bursts of device changes into a single refresh, guarded by _update_lock
+        self._update_timer: Optional[threading.Timer] = None
+        self._update_lock = threading.Lock()
+        # COM-initialized workers: open endpoints that have to be looked up again without
+        # holding up startup, and re-enumerate devices after a device change
+        self._init_executor = ThreadPoolExecutor(max_workers=2, initializer=CoInitialize)
+        # Number of those initializations still running, guarded by _init_lock
+        self._pending_inits = 0
+        self._init_lock = threading.Lock()
+        add_device_change_listener(self._on_devices_changed)
         self._setup_linker()
+        # Device lookup goes through COM enumeration, so run it alongside the rest of startup
+        self._init_thread = threading.Thread(target=self._setup_devices, daemon=True)
+        self._init_thread.start()
         self._setup_auto_start()
     
     def _setup_devices(self) -> None:
-        """Load and initialize devices from configuration."""
-        device1_id, device1_name = self.config.get_device1()
-        device2_id, device2_name = self.config.get_device2()
-        
-        if device1_id:
-            self.device1 = find_device_by_id(device1_id)
-            if not self.device1 and device1_name:
-                # Try to find by name if ID lookup fails
-                self.device1 = AudioDevice(device1_id, device1_name)
-                self.device1.initialize()
-        
-        if device2_id:
-            self.device2 = find_device_by_id(device2_id)
-            if not self.device2 and device2_name:
-                # Try to find by name if ID lookup fails
-                self.device2 = AudioDevice(device2_id, device2_name)
-                self.device2.initialize()
+        """Load and initialize devices from configuration, then hand them to the linker."""
+        CoInitialize()
+        try:
+            device1_id, device1_name = self.config.get_device1()
+            device2_id, device2_name = self.config.get_device2()
+            pending: List[AudioDevice] = []
+            
+            if device1_id:
+                self.device1 = find_device_by_id(device1_id)
+                if not self.device1 and device1_name:
+                    # Try to find by name if ID lookup fails
+                    self.device1 = AudioDevice(device1_id, device1_name)
+                    pending.append(self.device1)
+            
+            if device2_id:
+                self.device2 = find_device_by_id(device2_id)
+                if not self.device2 and device2_name:
+                    # Try to find by name if ID lookup fails
+                    self.device2 = AudioDevice(device2_id, device2_name)
+                    pending.append(self.device2)
+            
+            if not pending:
+                self.linker.set_devices(self.device1, self.device2)
+                return
+            # The linker retries devices that aren't available, so only hand them over once
+            # the workers are done rather than have both initialize the same device
+            self._pending_inits = len(pending)
+            for device in pending:
+                future = self._init_executor.submit(device.initialize)
+                future.add_done_callback(self._on_device_initialized)
+        finally:
+            CoUninitialize()
+    
+    def _on_device_initialized(self, future: Future) -> None:
+        """Pass the configured devices to the linker once the last initialization has finished."""
+        with self._init_lock:
+            self._pending_inits -= 1
+            if self._pending_inits:
+                return
+        self.linker.set_devices(self.device1, self.device2)
     
     def _setup_linker(self) -> None:
-        """Initialize the audio linker."""
-        self.linker = AudioLinker(self.device1, self.device2)
-        self.linker.set_enabled(self.config.is_linking_enabled())
+        """Initialize the audio linker; devices are added once _setup_devices has found them."""
+        self.linker = AudioLinker(None, None)
+        self._linking_enabled = self.config.is_linking_enabled()
+        self.linker.set_enabled(self._linking_enabled)
         self.linker.start()
     
     def _setup_auto_start(self) -> None:
@@ -60,24 +127,8 @@ class AudioLinkApp:
             self.config.set_auto_start(registry_state)
     
     def _create_icon_image(self) -> Image.Image:
-        """Create a simple icon image for the system tray."""
-        # Create a 64x64 image with transparent background
-        image = Image.new('RGBA', (64, 64), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(image)
-        
-        # Draw two overlapping circles to represent linked devices
-        # Device 1 (left circle)
-        draw.ellipse([8, 20, 28, 40], fill=(70, 130, 180, 255), outline=(50, 100, 150, 255), width=2)
-        # Device 2 (right circle)
-        draw.ellipse([36, 20, 56, 40], fill=(70, 130, 180, 255), outline=(50, 100, 150, 255), width=2)
-        # Connection line
-        draw.line([28, 30, 36, 30], fill=(70, 130, 180, 255), width=3)
-        
-        # Draw volume waves
-        draw.arc([12, 8, 24, 20], start=0, end=180, fill=(100, 150, 200, 255), width=2)
-        draw.arc([40, 8, 52, 20], start=0, end=180, fill=(100, 150, 200, 255), width=2)
-        
-        return image
+        """Create the icon image for the system tray."""
+        return Image.open(io.BytesIO(base64.b64decode(ICON_PNG))).copy()
     
     def _get_device1_name(self) -> str:
         """Get display name for device 1."""
@@ -93,93 +144,137 @@ class AudioLinkApp:
         _, name = self.config.get_device2()
         return name[:30] if name else "Not selected"
     
-    def _create_device1_menu(self) -> Menu:
-        """Create submenu for device 1 selection."""
-        devices = get_all_audio_devices()
-        if not devices:
-            return Menu(item("No devices found", None))
-        
-        # Get current device 1 ID for checkmark
-        current_device1_id, _ = self.config.get_device1()
+    def _get_cached_devices(self) -> List[Tuple[str, str, str]]:
+        """Get output devices, enumerating them only after a device change."""
+        with self._devices_lock:
+            devices = self._devices_cache
+            generation = self._devices_generation
+        if devices is not None:
+            return devices
         
-        device_items = []
-        for device_id, device_name in devices:
-            def make_handler(did, dname):
-                def handler(icon, item):
-                    self.device1 = find_device_by_id(did)
-                    if self.device1:
-                        self.config.set_device1(did, dname)
-                        self.linker.set_devices(self.device1, self.device2)
-                        self._update_menu()
-                return handler
-            
-            device_items.append(
-                item(
-                    device_name[:38],
-                    make_handler(device_id, device_name),
-                    checked=lambda item, did=device_id: current_device1_id == did
-                )
-            )
-        
-        return Menu(*device_items)
+        infos = get_output_devices()
+        # Truncate the labels once per enumeration instead of on every submenu build
+        devices = [(info.id, info.name, info.name[:38]) for info in infos]
+        with self._devices_lock:
+            # An empty list may be a failed enumeration, so leave it to the next build to retry
+            if devices and generation == self._devices_generation:
+                self._devices_cache = devices
+                # Keep the enumerated IMMDevices so selecting a device doesn't look it up again
+                self._device_infos = {info.id: info for info in infos}
+        return devices
+    
+    def _on_devices_changed(self) -> None:
+        """Drop the cached device list after a device change and schedule its refresh."""
+        with self._devices_lock:
+            self._devices_cache = None
+            self._devices_generation += 1
+        self._schedule_devices_refresh()
     
-    def _create_device2_menu(self) -> Menu:
-        """Create submenu for device 2 selection."""
-        devices = get_all_audio_devices()
+    def _auto_start_cached(self, ttl: float = 2.0) -> bool:
+        """Get the auto-start state, re-reading the registry only when the cached value is stale."""
+        now = time.monotonic()
+        if now - self._auto_start_cache[0] > ttl:
+            self._auto_start_cache = (now, is_auto_start_enabled())
+        return self._auto_start_cache[1]
+    
+    def _create_device_menu_items(self, slot: int) -> Tuple[item, ...]:
+        """Create the items of the submenu for selecting device 1 or 2."""
+        devices = self._get_cached_devices()
         if not devices:
-            return Menu(item("No devices found", None))
+            return (item("No devices found", None),)
         
-        # Get current device 2 ID for checkmark
-        current_device2_id, _ = self.config.get_device2()
+        get_device = self.config.get_device1 if slot == 1 else self.config.get_device2
         
         device_items = []
-        for device_id, device_name in devices:
-            def make_handler(did, dname):
-                def handler(icon, item):
-                    self.device2 = find_device_by_id(did)
-                    if self.device2:
-                        self.config.set_device2(did, dname)
-                        self.linker.set_devices(self.device1, self.device2)
-                        self._update_menu()
-                return handler
-            
+        for device_id, device_name, label in devices:
             device_items.append(
                 item(
-                    device_name[:38],
-                    make_handler(device_id, device_name),
-                    checked=lambda item, did=device_id: current_device2_id == did
+                    label,
+                    partial(self._select_device, slot, device_id, device_name),
+                    # Read the selection when pystray asks, not when the menu was built
+                    checked=lambda item, did=device_id: get_device()[0] == did
                 )
             )
         
-        return Menu(*device_items)
+        return tuple(device_items)
+    
+    def _device1_menu_items(self) -> Tuple[item, ...]:
+        """Create the items of the device 1 submenu."""
+        return self._create_device_menu_items(1)
+    
+    def _device2_menu_items(self) -> Tuple[item, ...]:
+        """Create the items of the device 2 submenu."""
+        return self._create_device_menu_items(2)
+    
+    def _select_device(self, slot: int, device_id: str, device_name: str, icon, item) -> None:
+        """Handle selecting an output device for device 1 or 2."""
+        current = getattr(self, f"device{slot}")
+        if current and current.device_id == device_id:
+            # Already selected, nothing to do
+            return
+        # Activate the device from the list the menu was built from instead of enumerating again.
+        # Each selection gets its own AudioDevice, so one endpoint picked for both slots
+        # doesn't share a volume callback registration between them
+        info = self._device_infos.get(device_id)
+        if info is None:
+            # The menu was built from a list that couldn't be cached
+            device = find_device_by_id(device_id)
+        else:
+            device = AudioDevice.from_device_info(info)
+            if not device.initialize():
+                device = None
+        setattr(self, f"device{slot}", device)
+        if device:
+            set_device = self.config.set_device1 if slot == 1 else self.config.set_device2
+            set_device(device_id, device_name)
+            self.linker.set_devices(self.device1, self.device2)
     
     def _toggle_linking(self, icon, item) -> None:
         """Toggle volume linking on/off."""
-        enabled = not self.linker.is_enabled()
+        enabled = not self._linking_enabled
+        self._linking_enabled = enabled
         self.linker.set_enabled(enabled)
         self.config.set_linking_enabled(enabled)
-        self._update_menu()
     
     def _toggle_auto_start(self, icon, item) -> None:
         """Toggle auto-start on/off."""
         new_state = toggle_auto_start()
+        self._auto_start_cache = (time.monotonic(), new_state)
         self.config.set_auto_start(new_state)
-        self._update_menu()
     
-    def _update_menu(self) -> None:
-        """Update the system tray menu."""
-        if self.icon:
-            self.icon.menu = self._create_menu()
+    def _schedule_devices_refresh(self) -> None:
+        """Schedule re-enumerating devices, coalescing device changes made in quick succession.
+        
+        Only the device list is refreshed; the menu itself is left to pystray, which
+        rebuilds it on the icon thread after every menu callback. Rebuilding it from
+        here could destroy the native menu while it is being shown.
+        """
+        with self._update_lock:
+            if self._update_timer:
+                self._update_timer.cancel()
+            self._update_timer = threading.Timer(0.05, self._refresh_devices)
+            self._update_timer.daemon = True
+            self._update_timer.start()
+    
+    def _refresh_devices(self) -> None:
+        """Enumerate devices on a COM-initialized worker so the next menu build finds them cached."""
+        try:
+            self._init_executor.submit(self._get_cached_devices)
+        except RuntimeError:
+            # The executor has been shut down on exit
+            pass
     
     def _create_menu(self) -> Menu:
         """Create the system tray menu."""
+        # Built once; labels, checkmarks and submenu items are evaluated by pystray
+        # whenever it builds the menu
         menu_items = [
-            item("Linking Enabled", self._toggle_linking, checked=lambda item: self.linker.is_enabled()),
+            item("Linking Enabled", self._toggle_linking, checked=lambda item: self._linking_enabled),
             item("---", None),
-            item(f"Device 1: {self._get_device1_name()}", self._create_device1_menu()),
-            item(f"Device 2: {self._get_device2_name()}", self._create_device2_menu()),
+            item(lambda item: f"Device 1: {self._get_device1_name()}", Menu(self._device1_menu_items)),
+            item(lambda item: f"Device 2: {self._get_device2_name()}", Menu(self._device2_menu_items)),
             item("---", None),
-            item("Auto-start", self._toggle_auto_start, checked=lambda item: is_auto_start_enabled()),
+            item("Auto-start", self._toggle_auto_start, checked=lambda item: self._auto_start_cached()),
             item("---", None),
             item("Exit", self._on_exit)
         ]
@@ -188,22 +283,40 @@ class AudioLinkApp:
     
     def _on_exit(self, icon, item) -> None:
         """Handle application exit."""
+        with self._update_lock:
+            if self._update_timer:
+                self._update_timer.cancel()
+        self._init_executor.shutdown(wait=False)
         if self.linker:
             self.linker.stop()
+        # Write out any settings change still waiting on the save timer
+        self.config.close()
         icon.stop()
     
     def run(self) -> None:
         """Run the application."""
         image = self._create_icon_image()
+        # The menu shows the selected devices, so wait for them to be set up
+        self._init_thread.join()
         menu = self._create_menu()
         
         self.icon = pystray.Icon("AudioLink", image, "Audio Device Volume Linker", menu)
         self.icon.run()
 
 
+def _prefetch_config() -> None:
+    """Read the config file so it's already cached by the OS when ConfigManager loads it."""
+    try:
+        get_config_path().read_bytes()
+    except OSError:
+        pass
+
+
 def main():
     """Main entry point."""
     try:
+        # Mostly helps on a cold start at login, when the file isn't cached yet
+        threading.Thread(target=_prefetch_config, daemon=True).start()
         app = AudioLinkApp()
         app.run()
     except KeyboardInterrupt: